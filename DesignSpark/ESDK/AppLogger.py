@@ -5,23 +5,31 @@
 Logging functions
 '''
 
+import atexit
 import logging
+import logging.handlers
+import queue
 
 _format = "%(asctime)s [%(levelname)s] %(name)s %(threadName)s: %(message)s"
+_formatter = logging.Formatter(_format)
+
+# Names of loggers already configured - repeat getLogger calls return the
+# existing logger untouched, the first caller's settings win
+_configured = set()
 
 def getStreamHandler(debug):
     """ Returns a stream handler.
 
     :param debug: Enables debug logging.
     :type debug: bool
-    
+
     """
     stream_handler = logging.StreamHandler()
     if debug:
         stream_handler.setLevel(logging.DEBUG)
     else:
         stream_handler.setLevel(logging.INFO)
-    stream_handler.setFormatter(logging.Formatter(_format))
+    stream_handler.setFormatter(_formatter)
     return stream_handler
 
 def getLogFileHandler(debug, logFile='/aq/log/aq.log'):
@@ -29,14 +37,14 @@ def getLogFileHandler(debug, logFile='/aq/log/aq.log'):
 
     :param logFile: Log file path (default is /aq/log/aq.log).
     :type logFile: str, optional
-    
+
     """
     file_handler_log = logging.FileHandler(logFile, mode='w', encoding='utf-8')
     if debug:
         file_handler_log.setLevel(logging.DEBUG)
     else:
         file_handler_log.setLevel(logging.INFO)
-    file_handler_log.setFormatter(logging.Formatter(_format))
+    file_handler_log.setFormatter(_formatter)
     return file_handler_log
 
 def getErrorLogFileHandler(errorFile='/aq/log/error.log'):
@@ -48,12 +56,15 @@ def getErrorLogFileHandler(errorFile='/aq/log/error.log'):
     """
     file_handler_error = logging.FileHandler(errorFile, mode='w', encoding='utf-8')
     file_handler_error.setLevel(logging.ERROR)
-    file_handler_error.setFormatter(logging.Formatter(_format))
+    file_handler_error.setFormatter(_formatter)
     return file_handler_error
 
 def getLogger(name, debug=False, loggingSetup='full'):
     """ Returns a logger object.
 
+    Handlers are serviced by a background queue listener thread, so logging calls
+    in sensor-reading hot paths return without waiting on terminal or file writes.
+
     :param debug: Controls whether the debug log level is enabled (default is False)
     :type debug: bool, optional
     :param loggingSetup: One of 'off', 'error' or 'full' log levels (default is 'full')
@@ -61,25 +72,32 @@ def getLogger(name, debug=False, loggingSetup='full'):
 
     """
     logger = logging.getLogger(name)
+    if name in _configured:
+        return logger
     if logger.hasHandlers():
         logger.handlers.clear()
-    
+
     if debug:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
-    logger.addHandler(getStreamHandler(debug))
+    handlers = [getStreamHandler(debug)]
 
     if loggingSetup == 'full':
-        logger.debug("Setting file logging to full")
-        logger.addHandler(getLogFileHandler(debug))
-        logger.addHandler(getErrorLogFileHandler())
+        handlers.append(getLogFileHandler(debug))
+        handlers.append(getErrorLogFileHandler())
     elif loggingSetup == 'error':
-        logger.debug("Setting file logging to error only")
-        logger.addHandler(getErrorLogFileHandler())
+        handlers.append(getErrorLogFileHandler())
     elif loggingSetup == 'off':
-        logger.debug("Setting file logging off")
+        pass
     else:
         logger.warn("Invalid file logging level: {}".format(loggingSetup))
 
-    return logger
\ No newline at end of file
+    logQueue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(logQueue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(logQueue))
+    _configured.add(name)
+
+    return logger
@@ -6,29 +6,36 @@ ESDK CO2 board interface
 '''
 
 import time
-import smbus2
+import struct
 from smbus2 import i2c_msg
+from ._i2c import busLock, getSharedBus
 
 moduleVersionString = "CO20.2"
 
 SCD_ADDR = 0x62
 
+# SCD4x produces a new sample every 5 seconds in periodic measurement mode,
+# so polling the data-ready flag more often than this just wastes bus time
+SCD_SAMPLE_HOLDOFF = 4.8
+
 class ModCO2:
-    """ This is a class that handles interfacing with the ESDK-CO2 board. """
-    def __init__(self):
-        try:
-            self.bus = smbus2.SMBus(1)
-        except Exception as e:
-            raise e
+    """ This is a class that handles interfacing with the ESDK-CO2 board.
+
+    :param bus: An optional shared SMBus object, the shared bus handle is used if not supplied
+    :type bus: smbus2.SMBus, optional
+    """
+    def __init__(self, bus=None):
+        self.bus = bus if bus is not None else getSharedBus()
+
+        self.__lastData = None
+        self.__nextReadyTime = 0
 
         self.__startPeriodicMeasurement()
 
     def __startPeriodicMeasurement(self):
         """ Starts periodic measurement mode. """
-        try:
+        with busLock:
             self.bus.write_i2c_block_data(SCD_ADDR, 0x21, [0xB1])
-        except Exception as e:
-            raise e
 
     def __isDataReady(self):
         """ Query SCD4x to see if there is available readings
@@ -37,32 +44,44 @@ class ModCO2:
         :rtype: bool
 
         """
-        try:
-            write = i2c_msg.write(SCD_ADDR, [0xE4, 0xB8])
-            read = i2c_msg.read(SCD_ADDR, 3)
+        write = i2c_msg.write(SCD_ADDR, [0xE4, 0xB8])
+        read = i2c_msg.read(SCD_ADDR, 3)
+        with busLock:
             self.bus.i2c_rdwr(write, read)
-            state = (list(read)[0] << 8) + list(read)[1]
-            if state != 0x8000:
-                return True
-            else:
-                return False
-        except Exception as e:
-            raise e
+        buf = bytes(read)
+        state = (buf[0] << 8) | buf[1]
+        if state != 0x8000:
+            return True
+        else:
+            return False
 
     def __readSensorData(self):
         """ Reads all available sensor data
 
-        :return: A list of 9 bytes from the sensor
-        :rtype: list
+        :return: 9 bytes of raw data from the sensor
+        :rtype: bytes
 
         """
-        try:
-            write = i2c_msg.write(SCD_ADDR, [0xEC, 0x05])
-            read = i2c_msg.read(SCD_ADDR, 9)
+        write = i2c_msg.write(SCD_ADDR, [0xEC, 0x05])
+        read = i2c_msg.read(SCD_ADDR, 9)
+        with busLock:
             self.bus.i2c_rdwr(write, read)
-            return list(read)
-        except Exception as e:
-            raise e
+        return bytes(read)
+
+    def _readAll(self):
+        """ Returns the last sensor frame, fetching a fresh one if the sample period has elapsed.
+
+        :return: 9 bytes of raw sensor data, or None if no data is available
+        :rtype: bytes, None
+
+        """
+        if time.monotonic() < self.__nextReadyTime and self.__lastData is not None:
+            return self.__lastData
+        if self.__isDataReady():
+            self.__lastData = self.__readSensorData()
+            self.__nextReadyTime = time.monotonic() + SCD_SAMPLE_HOLDOFF
+            return self.__lastData
+        return None
 
     def readCO2(self):
         """ Reads a CO2 value from the sensor
@@ -71,16 +90,13 @@ class ModCO2:
         :rtype: int
 
         """
-        try:
-            if self.__isDataReady():
-                v = self.__readSensorData()
-                co2 = (v[0] << 8) + v[1]
+        v = self._readAll()
+        if v is None:
+            return -1
 
-                return co2
-            else:
-                return -1
-        except Exception as e:
-            raise e
+        co2, = struct.unpack_from('>H', v)
+
+        return co2
 
     def readTempAndHumidity(self):
         """ Reads temperature and humidity from the sensor
@@ -98,23 +114,20 @@ class ModCO2:
 
         :rtype: dict, int
         """
-        try:
-            if self.__isDataReady():
-                v = self.__readSensorData()
-                
-                temperature = round(-45 + (175 * ((v[3] << 8) + v[4]) / 65535.0), 1)
-                humidity = round(100 * ((v[6] << 8) + v[7]) / 65535.0, 1)
-
-                rv = {
-                "temp": temperature,
-                "humidity": humidity
-                }
+        v = self._readAll()
+        if v is None:
+            return -1
+
+        _, rawTemperature, rawHumidity = struct.unpack_from('>HxHxHx', v)
+        temperature = round(-45 + (175 * rawTemperature / 65535.0), 1)
+        humidity = round(100 * rawHumidity / 65535.0, 1)
 
-                return rv
-            else:
-                return -1
-        except Exception as e:
-            raise e
+        rv = {
+        "temp": temperature,
+        "humidity": humidity
+        }
+
+        return rv
 
     def readSensors(self):
         """ Reads sensors and returns a dictionary containing module version, and all readings.
@@ -122,27 +135,30 @@ class ModCO2:
         :return: A dictionary containing
 
         .. code-block:: text
-            
+
             {
                 "co2":{
                     "sensor":"CO20.2",
-                    "co2":453
+                    "co2":453,
+                    "temperature":21.2,
+                    "humidity":50.3
                 }
             }
-            
+
         Or -1 if data is unavailable
 
         :rtype: dict, int
 
         """
-        try:
-            sensorData = {}
-            co2Reading = self.readCO2()
-            sensorData['sensor'] = moduleVersionString
-            if co2Reading != -1:
-                sensorData['co2'] = co2Reading
-                return {'co2': sensorData}
-            else:
-                return -1
-        except Exception as e:
-            raise e
\ No newline at end of file
+        v = self._readAll()
+        if v is None:
+            return -1
+
+        co2, rawTemperature, rawHumidity = struct.unpack_from('>HxHxHx', v)
+
+        sensorData = {}
+        sensorData['sensor'] = moduleVersionString
+        sensorData['co2'] = co2
+        sensorData['temperature'] = round(-45 + (175 * rawTemperature / 65535.0), 1)
+        sensorData['humidity'] = round(100 * rawHumidity / 65535.0, 1)
+        return {'co2': sensorData}
\ No newline at end of file
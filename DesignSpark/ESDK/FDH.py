@@ -6,47 +6,47 @@ ESDK FDH board interface
 '''
 
 import time
-import smbus2
+import struct
 from smbus2 import i2c_msg
+from ._i2c import busLock, getSharedBus
 
 moduleVersionString = "FDH0.1"
 
 SFA_ADDR = 0x5D
 
 class ModFDH:
-	""" This is a class that handles interfacing with the ESDK-FDH board. """
-	def __init__(self):
-		try:
-			self.bus = smbus2.SMBus(1)
-		except Exception as e:
-			raise e
+	""" This is a class that handles interfacing with the ESDK-FDH board.
+
+	:param bus: An optional shared SMBus object, the shared bus handle is used if not supplied
+	:type bus: smbus2.SMBus, optional
+	"""
+	def __init__(self, bus=None):
+		self.bus = bus if bus is not None else getSharedBus()
 
 		self._startPeriodicMeasurement()
 
 	def _startPeriodicMeasurement(self):
 		""" Starts the sensor periodic measurement mode. """
-		try:
+		with busLock:
 			self.bus.write_i2c_block_data(SFA_ADDR, 0x00, [0x06])
-		except Exception as e:
-			raise e
 
 	def _readSensorData(self):
 		""" Reads all available sensor data
 
-		:return: A list of 9 bytes of sensor data
-		:rtype: list
+		:return: 9 bytes of raw sensor data
+		:rtype: bytes
 
 		"""
 
-		try:
-			write = i2c_msg.write(SFA_ADDR, [0x03, 0x27])
-			read = i2c_msg.read(SFA_ADDR, 9)
+		write = i2c_msg.write(SFA_ADDR, [0x03, 0x27])
+		read = i2c_msg.read(SFA_ADDR, 9)
+		# Hold the bus for the whole command/wait/read sequence
+		with busLock:
 			self.bus.i2c_rdwr(write)
+			# Datasheet requires a 5ms wait between command and read
 			time.sleep(0.005)
-			self.bus.i2c_rdwr(write, read)
-			return list(read)
-		except Exception as e:
-			raise e
+			self.bus.i2c_rdwr(read)
+		return bytes(read)
 
 	def readFormaldehyde(self):
 		""" Reads a formaldehyde value from the sensor
@@ -55,12 +55,9 @@ class ModFDH:
 		:rtype: int
 
 		"""
-		try:
-			data = self._readSensorData()
-			hcho = int(((data[0] << 8) + data[1]) / 5.0)
-			return hcho
-		except Exception as e:
-			raise e
+		data = self._readSensorData()
+		hcho = struct.unpack_from('>H', data)[0] // 5
+		return hcho
 
 	def readSensors(self):
 		""" Reads sensors and returns a dictionary containing module version and readings.
@@ -79,11 +76,8 @@ class ModFDH:
 		:rtype: dict
 
 		"""
-		try:
-			sensorData = {}
-			hcho = self.readFormaldehyde()
-			sensorData['sensor'] = moduleVersionString
-			sensorData['formaldehyde'] = hcho
-			return {'fdh': sensorData}
-		except Exception as e:
-			raise e
\ No newline at end of file
+		sensorData = {}
+		hcho = self.readFormaldehyde()
+		sensorData['sensor'] = moduleVersionString
+		sensorData['formaldehyde'] = hcho
+		return {'fdh': sensorData}
\ No newline at end of file
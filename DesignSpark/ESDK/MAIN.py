@@ -5,18 +5,19 @@
 ESDK Main board interface
 '''
 
-import smbus2
-import toml
+import concurrent.futures
+import logging
+import time
 import threading
-import re
 import subprocess
-import pkg_resources
-import imp
+import importlib.util
 import inspect
 import os
+from importlib.metadata import version as packageVersion
 import RPi.GPIO as GPIO
 from gpsdclient import GPSDClient
 from . import AppLogger
+from ._i2c import busLock, getSharedBus
 from . import MAIN, THV, CO2, PM2, NO2, NRD, FDH
 
 possibleModules = {
@@ -28,22 +29,43 @@ possibleModules = {
     "FDH": 0x5D
 }
 
-moduleTypeDict = {
-    'THV': THV,
-    'CO2': CO2,
-    'PM2': PM2,
-    'NO2': NO2,
-    "NRD": NRD,
-    "FDH": FDH
+moduleClassDict = {
+    'THV': THV.ModTHV,
+    'CO2': CO2.ModCO2,
+    'PM2': PM2.ModPM2,
+    'NO2': NO2.ModNO2,
+    "NRD": NRD.ModNRD,
+    "FDH": FDH.ModFDH
 }
 
+# Package version never changes at runtime, look it up once at import
+try:
+    _MODULE_VERSION = packageVersion('DesignSpark.ESDK')
+except Exception:
+    # Running from a source tree without installed metadata
+    _MODULE_VERSION = 'unknown'
+
 # GPIOs used for board features
 SENSOR_3V3_EN = 7
 SENSOR_5V_EN = 16
 BUZZER_PIN = 26
 GPIO_LIST = [SENSOR_3V3_EN, SENSOR_5V_EN, BUZZER_PIN]
 
-strip_unicode = re.compile("([^-_a-zA-Z0-9!@#%&=,/'\";:~`\$\^\*\(\)\+\[\]\.\{\}\|\?\<\>\\]+|[^\s]+)")
+# Firmware throttle state exposed by the kernel - reading this is far cheaper
+# than forking vcgencmd
+THROTTLED_SYSFS_PATH = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+# Throttle state descriptions keyed on bit position in the get_throttled code
+_THROTTLE_BITS = {
+    0: "Under_Voltage detected",
+    1: "Arm frequency capped",
+    2: "Currently throttled",
+    3: "Soft temperature limit active",
+    16: "Under-voltage has occurred",
+    17: "Arm frequency capping has occurred",
+    18: "Throttling has occurred",
+    19: "Soft temperature limit has occurred"
+}
 
 class ModMAIN:
     """ This class handles the ESDK mainboard, and it's various features.
@@ -68,14 +90,11 @@ class ModMAIN:
     """
     def __init__(self, config, debug=False, loggingLevel='full', pluginDir=None):
         self.logger = AppLogger.getLogger(__name__, debug, loggingLevel)
-        try:
-            self.bus = smbus2.SMBus(1)
+        self.bus = getSharedBus()
 
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setup(GPIO_LIST, GPIO.OUT)
-            self.buzzer_pwm = GPIO.PWM(BUZZER_PIN, 1000)
-        except Exception as e:
-            raise e
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(GPIO_LIST, GPIO.OUT)
+        self.buzzer_pwm = GPIO.PWM(BUZZER_PIN, 1000)
 
         self.moduleNames = []
         self.sensorModules = {}
@@ -86,62 +105,108 @@ class ModMAIN:
         self.pluginDir = pluginDir
         self.pluginsModuleList = []
         self.plugins = []
+        self._probed = False
+        self._executor = None
+        self._pendingFutures = {}
+        self._loadedPluginPaths = set()
+        self._throttleCache = (0, None)
+        self._hardwareId = None
         self._parseConfig()
 
     def _parseConfig(self):
         """ Parse config when mainboard initialised """
+        # Normalise the flag to a boolean once, so hot paths test an attribute
+        # rather than chained config dict comparisons
+        self._gpsEnabled = bool(self.configDict.get('ESDK', {}).get('gps'))
         if 'ESDK' in self.configDict:
             if 'gps' in self.configDict['ESDK']:
-                if self.configDict['ESDK']['gps'] is not None:
-                    if self.configDict['ESDK']['gps'] == True:
-                        self.logger.info("GPS is enabled")
-                        self.gps = GPSDClient(host="localhost")
-                        gpsHandlerThreadHandle = threading.Thread(target=self._gpsHandlerThread, daemon=True)
-                        gpsHandlerThreadHandle.name = "gpsHandlerThread"
-                        gpsHandlerThreadHandle.start()
+                if self._gpsEnabled:
+                    self.logger.info("GPS is enabled")
+                    self.gps = GPSDClient(host="localhost")
+                    gpsHandlerThreadHandle = threading.Thread(target=self._gpsHandlerThread, daemon=True)
+                    gpsHandlerThreadHandle.name = "gpsHandlerThread"
+                    gpsHandlerThreadHandle.start()
+                else:
+                    # Static location never changes, so resolve it once here rather
+                    # than on every getLocation call
+                    self.location['lat'] = self.configDict['ESDK']['latitude']
+                    self.location['lon'] = self.configDict['ESDK']['longitude']
 
     def _gpsHandlerThread(self):
         """ Thread for polling GPS module. """
         self.logger.debug("Started GPS handling thread")
+        lastUpdateTime = 0
+        backoff = 0.1
+        # Hoist the inner status dict lookup out of the message loop
+        gpsStatus = self.gpsStatus['gpsStatus']
         while True:
             try:
                 for result in self.gps.dict_stream():
+                    # Messages are flowing again, so reset the failure backoff
+                    backoff = 0.1
+
                     if result["class"] == "TPV":
-                        self.location['lat'] = result.get("lat", "n/a")
-                        self.location['lon'] = result.get("lon", "n/a")
-                        self.logger.debug("GPS location {}".format(self.location))
-                        self.gpsStatus['gpsStatus'].update({'mode': result.get("mode", 0)})
+                        # gpsd can emit fixes at up to 10Hz, far faster than
+                        # readings are consumed - throttle position updates to
+                        # 1Hz to keep this thread cheap. SKY reports already
+                        # arrive slowly, so they bypass the throttle below
+                        now = time.monotonic()
+                        if now - lastUpdateTime < 1.0:
+                            continue
+                        lastUpdateTime = now
+                        # Publish by rebinding a fresh dict - binding is atomic under
+                        # the GIL, so readers on other threads always see a matching
+                        # lat/lon pair rather than a half-updated one
+                        location = {'lat': result.get("lat", "n/a"), 'lon': result.get("lon", "n/a")}
+                        self.location = location
+                        # Only build the log string when debug is actually enabled
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug("GPS location {}".format(location))
+                        gpsStatus['mode'] = result.get("mode", 0)
 
                     if result["class"] == "SKY":
-                        satellitesList = result.get("satellites", "")
-                        satellitesUsedCount = 0
-
-                        for satellite in satellitesList:
-                            if satellite['used']:
-                                satellitesUsedCount = satellitesUsedCount + 1
+                        satellitesList = result.get("satellites", ())
+                        satellitesUsedCount = sum(1 for satellite in satellitesList if satellite.get('used'))
 
-                        self.gpsStatus['gpsStatus'].update({'satellitesUsed': satellitesUsedCount})
+                        gpsStatus['satellitesUsed'] = satellitesUsedCount
 
             except Exception as e:
                 self.logger.error("Error getting GPS location, reason: {}".format(e))
+                # Back off exponentially so a dead gpsd socket doesn't spin this
+                # thread at 100% CPU
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+
+    def _probeModules(self, force=False):
+        """ Probes I2C bus to attempt to find sensor modules.
+
+        Probe results are cached, as modules are only swapped with the power off;
+        pass ``force=True`` to rescan the bus.
 
-    def _probeModules(self):
-        """ Probes I2C bus to attempt to find sensor modules. """
+        :param force: Forces a rescan of the bus, defaults to False
+        :type force: bool, optional
+        """
+        if self._probed and not force:
+            self.logger.debug("Using cached module probe results")
+            return
         self.moduleNames.clear()
         self.logger.debug("Starting module probe")
         for module, addr in possibleModules.items():
             try:
                 # ADC used on NO2 board is an annoying edge case, does not seemingly acknowledge 0x0
                 if module != "NO2":
-                    self.bus.write_byte(addr, 0)
+                    with busLock:
+                        self.bus.write_byte(addr, 0)
                     self.moduleNames.append(module)
                 else:
                     # Instead issue reset command, and check for an acknowledgement
-                    self.bus.write_byte(addr, 0x06)
+                    with busLock:
+                        self.bus.write_byte(addr, 0x06)
                     self.moduleNames.append(module)
             except Exception as e:
                 # Ignore any that fail - the modules aren't present on the bus
                 pass
+        self._probed = True
         self.logger.info("Found modules {}".format(self.moduleNames))
 
     def getLocation(self):
@@ -159,16 +224,13 @@ class ModMAIN:
         :rtype: dict
 
         """
-        if self.configDict['ESDK']['gps'] == False or self.configDict['ESDK']['gps'] is None:
-            self.location['lat'] = self.configDict['ESDK']['latitude']
-            self.location['lon'] = self.configDict['ESDK']['longitude']
+        if not self._gpsEnabled:
             return self.location
 
-        if self.configDict['ESDK']['gps'] == True:
-            if "lat" and "lon" in self.location:
-                return self.location
-            else:
-                return {}
+        if "lat" in self.location and "lon" in self.location:
+            return self.location
+        else:
+            return {}
 
     def getGPSStatus(self):
         """ Returns a dictionary containing GPS status. 
@@ -196,40 +258,55 @@ class ModMAIN:
         self.logger.debug("Creating module objects")
         for moduleName in self.moduleNames:
             try:
-                if moduleName == "THV":
-                    self.sensorModules[moduleName] = moduleTypeDict[moduleName].ModTHV()
-
-                if moduleName == "CO2":
-                    self.sensorModules[moduleName] = moduleTypeDict[moduleName].ModCO2()
-
-                if moduleName == "PM2":
-                    self.sensorModules[moduleName] = moduleTypeDict[moduleName].ModPM2()
-
+                moduleClass = moduleClassDict[moduleName]
                 if moduleName == "NO2":
                     if "NO2" in self.configDict:
                         sensitivityCode = self.configDict["NO2"]["sensitivity"]
-                        self.sensorModules[moduleName] = moduleTypeDict[moduleName].ModNO2(sensitivity=sensitivityCode)
+                        self.sensorModules[moduleName] = moduleClass(sensitivity=sensitivityCode, bus=self.bus)
                     else:
                         raise Exception("No NO2 module configuration provided")
-
-                if moduleName == "NRD":
-                    self.sensorModules[moduleName] = moduleTypeDict[moduleName].ModNRD()
-
-                if moduleName == "FDH":
-                    self.sensorModules[moduleName] = moduleTypeDict[moduleName].ModFDH()
+                else:
+                    self.sensorModules[moduleName] = moduleClass(bus=self.bus)
             except Exception as e:
                 self.logger.error("Could not create module {}, reason: {}".format(moduleName, e))
 
     def readAllModules(self):
         """ Reads all sensor modules and returns a dictionary containing sensor data. """
+        # Build a fresh dict each cycle so readings from since-disconnected
+        # modules don't linger in the output forever
+        sensorData = {}
         try:
-            for name, module in self.sensorModules.items():
-                self.logger.debug("Trying to read sensor {}".format(name))
-                data = module.readSensors()
-                if data != -1:
-                    self.sensorData.update(data)
+            if self.sensorModules:
+                # Read modules concurrently - each one mostly waits on its sensor,
+                # and the shared bus lock serialises the actual transfers
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.sensorModules), thread_name_prefix="moduleRead")
+
+                for name, module in self.sensorModules.items():
+                    # Don't queue another read behind one that hasn't been
+                    # collected yet - a wedged module would otherwise grow the
+                    # executor's queue every cycle
+                    if name in self._pendingFutures:
+                        self.logger.debug("Previous read of {} still outstanding, not resubmitting".format(name))
+                        continue
+                    self.logger.debug("Trying to read sensor {}".format(name))
+                    self._pendingFutures[name] = self._executor.submit(module.readSensors)
+
+                for name, future in list(self._pendingFutures.items()):
+                    try:
+                        data = future.result(timeout=5.0)
+                        if data != -1:
+                            sensorData.update(data)
+                    except concurrent.futures.TimeoutError:
+                        self.logger.error("Timed out reading module {}".format(name))
+                        # Leave the future in place so the next cycle waits for
+                        # it instead of submitting a duplicate read
+                        continue
+                    except Exception as e:
+                        self.logger.error("Could not read module {}, reason: {}".format(name, e))
+                    del self._pendingFutures[name]
         except Exception as e:
-            self.logger.error("Could not read module {}, reason: {}".format(name, e))
+            self.logger.error("Error reading modules, reason: {}".format(e))
 
         # Read loaded plugins
         try:
@@ -239,14 +316,16 @@ class ModMAIN:
                 try:
                     data = plugin.readSensors()
                     if data != -1:
-                        self.sensorData.update(data)
+                        sensorData.update(data)
                 except Exception as e:
                     self.logger.error("Could not read plugin {}, reason: {}".format(pluginName, e))
         except Exception as e:
             self.logger.error("Error handling plugins, reason: {}".format(e))
 
-        self.logger.debug("Sensor data {}".format(self.sensorData))
-        return self.sensorData
+        self.sensorData = sensorData
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Sensor data {}".format(sensorData))
+        return sensorData
 
     def getSerialNumber(self):
         """ Returns a dictionary containing the Raspberry Pi serial number.
@@ -263,11 +342,14 @@ class ModMAIN:
 
         """
         try:
-            serialNumber = {}
-            with open('/sys/firmware/devicetree/base/serial-number') as f:
-                serialNumber['hardwareId'] = "RPI{}".format(strip_unicode.sub('',f.read()))
-                self.logger.info("Hardware ID is {}".format(serialNumber['hardwareId']))
-            return serialNumber
+            # Hardware serial never changes, so only read sysfs the first time
+            if self._hardwareId is None:
+                with open('/sys/firmware/devicetree/base/serial-number') as f:
+                    # The devicetree value is hex digits with a trailing NUL - no
+                    # need for a regex to clean it up
+                    self._hardwareId = "RPI{}".format(f.read().rstrip('\x00').strip())
+                    self.logger.info("Hardware ID is {}".format(self._hardwareId))
+            return {'hardwareId': self._hardwareId}
         except Exception as e:
             self.logger.error("Could not retrieve serial number, reason: {}".format(e))
             return -1
@@ -286,7 +368,7 @@ class ModMAIN:
         :rtype: dict
 
         """
-        return {"moduleVersion": pkg_resources.get_distribution('DesignSpark.ESDK').version}
+        return {"moduleVersion": _MODULE_VERSION}
 
     def getUndervoltageStatus(self):
         """ Returns a dictionary containing the Raspberry Pi throttle status and code.
@@ -306,34 +388,38 @@ class ModMAIN:
 
         """
         try:
-            cmdOutput = subprocess.run(["vcgencmd", "get_throttled"], capture_output=True)
-            statusData = cmdOutput.stdout.decode('ascii').strip().strip("throttled=")
+            # Throttle state is polled far more often than it changes - serve a
+            # cached response for up to a second
+            cacheTime, cachedResponse = self._throttleCache
+            if cachedResponse is not None and time.monotonic() - cacheTime < 1.0:
+                return cachedResponse
+
+            try:
+                with open(THROTTLED_SYSFS_PATH) as f:
+                    statusData = f.read().strip()
+            except OSError:
+                # Not every kernel exposes the firmware attribute - fall back to vcgencmd
+                cmdOutput = subprocess.run(["vcgencmd", "get_throttled"], capture_output=True)
+                statusData = cmdOutput.stdout.decode('ascii').strip().strip("throttled=")
 
             code = int(statusData, 16)
             status = {"code": code}
             response = {"throttle_state": status}
 
-            if statusData == "0x0":
-                return response
-
-            statusBits = [[0, "Under_Voltage detected"],
-                    [1, "Arm frequency capped"],
-                    [2, "Currently throttled"],
-                    [3, "Soft temperature limit active"],
-                    [16, "Under-voltage has occurred"],
-                    [17, "Arm frequency capping has occurred"],
-                    [18, "Throttling has occurred"],
-                    [19, "Soft temperature limit has occurred"]]
-
-            statusStrings = []
-
-            for x in range(0, len(statusBits)):
-                statusBitString = statusBits[x][1]
-                if (code & (1 << statusBits[x][0])):
-                    statusStrings.append(statusBitString)
-
-            status.update({"status_strings": statusStrings})
-            response = {"throttle_state": status}
+            if code != 0:
+                # Walk only the set bits rather than testing every known mask
+                statusStrings = []
+                remaining = code
+                while remaining:
+                    lowestBit = remaining & -remaining
+                    description = _THROTTLE_BITS.get(lowestBit.bit_length() - 1)
+                    if description is not None:
+                        statusStrings.append(description)
+                    remaining ^= lowestBit
+                status.update({"status_strings": statusStrings})
+                response = {"throttle_state": status}
+
+            self._throttleCache = (time.monotonic(), response)
             return response
 
         except Exception as e:
@@ -348,12 +434,10 @@ class ModMAIN:
         :param vcc5: 5V sensor power supply status, defaults to False
         :type vcc5: bool, optional
         """
-        try:
-            self.logger.debug("Setting sensor power rails, 3V3: {}, 5V: {}".format(vcc3, vcc5))
-            GPIO.output(SENSOR_3V3_EN, vcc3)
-            GPIO.output(SENSOR_5V_EN, vcc5)
-        except Exception as e:
-            raise e
+        self.logger.debug("Setting sensor power rails, 3V3: {}, 5V: {}".format(vcc3, vcc5))
+        # One batched call sets both rails with a single crossing into the
+        # RPi.GPIO C layer
+        GPIO.output([SENSOR_3V3_EN, SENSOR_5V_EN], [vcc3, vcc5])
 
     def setBuzzer(self, freq=0):
         """ Sets a PWM frequency on the buzzer output.
@@ -361,17 +445,14 @@ class ModMAIN:
         :param freq: Buzzer frequency, 0 stops the buzzer
         :type freq: int, optional
         """
-        try:
-            if freq > 0:
-                self.logger.debug("Setting buzzer frequency to {}".format(freq))
-                self.buzzer_pwm.start(50)
-                self.buzzer_pwm.ChangeFrequency(freq)
-
-            if freq == 0:
-                self.logger.debug("Stopping buzzer")
-                self.buzzer_pwm.stop()
-        except Exception as e:
-            raise e
+        if freq > 0:
+            self.logger.debug("Setting buzzer frequency to {}".format(freq))
+            self.buzzer_pwm.start(50)
+            self.buzzer_pwm.ChangeFrequency(freq)
+
+        if freq == 0:
+            self.logger.debug("Stopping buzzer")
+            self.buzzer_pwm.stop()
 
     def loadPlugins(self):
         """ Attempts to load and instantiate plugins from a specified folder. """
@@ -384,17 +465,18 @@ class ModMAIN:
             self.pluginFullPath = self.pluginDir
 
         # Create a list of available plugin modules
-        for filename in os.listdir(self.pluginFullPath):
-            modulename, extension = os.path.splitext(filename)
-            if extension == '.py':
-                file, path, descr = imp.find_module(modulename, [self.pluginFullPath])
-                if file:
-                    try:
-                        self.logger.debug("Found plugin module: {}".format(file.name))
-                        module = imp.load_module(modulename, file, path, descr)
-                        self.pluginsModuleList.append(module)
-                    except Exception as e:
-                        self.logger.error("Could not load plugin {}! Reason {}".format(file.name, e))
+        for entry in os.scandir(self.pluginFullPath):
+            modulename, extension = os.path.splitext(entry.name)
+            if extension == '.py' and entry.path not in self._loadedPluginPaths:
+                try:
+                    self.logger.debug("Found plugin module: {}".format(entry.name))
+                    spec = importlib.util.spec_from_file_location(modulename, entry.path)
+                    module = importlib.util.module_from_spec(spec)
+                    spec.loader.exec_module(module)
+                    self.pluginsModuleList.append(module)
+                    self._loadedPluginPaths.add(entry.path)
+                except Exception as e:
+                    self.logger.error("Could not load plugin {}! Reason {}".format(entry.name, e))
 
         # Create a list of instantiated plugin classes
         for pluginModule in self.pluginsModuleList:
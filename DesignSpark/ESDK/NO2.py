@@ -6,11 +6,12 @@ ESDK NO2 board interface
 '''
 
 import time
-import smbus2
 import threading
 import math
+from collections import deque
 from smbus2 import i2c_msg
-from statistics import mode
+from ._i2c import busLock, getSharedBus
+from statistics import median
 
 moduleVersionString = "NO20.1"
 
@@ -20,6 +21,18 @@ ADC_REF = 3.000
 
 ADC_UPPER = 0x7FFF
 
+# Volts per ADC count, computed once rather than on every conversion
+ADC_LSB = ADC_REF / ADC_UPPER
+
+# Sample cycles between reference voltage refreshes (one cycle is ~5 seconds)
+VREF_REFRESH_CYCLES = 12
+
+# ADC config register values selecting each input channel
+# AINn = GND, gain = 1, 20 SPS, single conversion, external reference
+ADC_CFG_VGAS = 0x61
+ADC_CFG_VREF = 0x81
+ADC_CFG_VTEMP = 0xA1
+
 class ModNO2:
 	""" This is a class that handles interfacing with the ESDK-PM2 board.
 
@@ -31,31 +44,36 @@ class ModNO2:
 	:type voffset: float, optional - default 0
 	:param movingAverageWindow: Window size for the NO2 moving average
 	:type movingAverageWindow: int, optional - default 15
+	:param bus: An optional shared SMBus object, the shared bus handle is used if not supplied
+	:type bus: smbus2.SMBus, optional
 	"""
-	def __init__(self, sensitivity=None, tia_gain=499, voffset=0, movingAverageWindow=15):
+	def __init__(self, sensitivity=None, tia_gain=499, voffset=0, movingAverageWindow=15, bus=None):
 		if sensitivity == None:
 			raise Exception("No NO2 sensitivity code provided")
 
-		try:
-			self.bus = smbus2.SMBus(1)
+		self.bus = bus if bus is not None else getSharedBus()
 
-			# Sensitivity should be read from the back of the sensing element
-			# As this varies from device to device
-			self.sensitivity = sensitivity
+		# Sensitivity should be read from the back of the sensing element
+		# As this varies from device to device
+		self.sensitivity = sensitivity
 
-			# TIA gain is provided by the Spec datasheet, and only changes on sensing element type
-			self.tia_gain = tia_gain
+		# TIA gain is provided by the Spec datasheet, and only changes on sensing element type
+		self.tia_gain = tia_gain
 
-			# Voffset figure used in calculation of gas concentration
-			self.voffset = voffset
+		# Voffset figure used in calculation of gas concentration
+		self.voffset = voffset
 
-			self.movingAverageWindow = movingAverageWindow
+		self.movingAverageWindow = movingAverageWindow
 
-			self.no2AverageList = []
-			# NO2 value updated in thread
-			self.no2Value = 0
-		except Exception as e:
-			raise e
+		# Reciprocal of the gain/sensitivity scale factor, precomputed so the
+		# polling thread does one multiply per reading instead of two divisions
+		self._invScale = 1.0 / (self.tia_gain * 1e3 * self.sensitivity * 1e-9)
+
+		# Moving average window and running sum, updated incrementally
+		self.no2AverageDeque = deque(maxlen=self.movingAverageWindow)
+		self.no2AverageSum = 0.0
+		# NO2 value updated in thread
+		self.no2Value = 0
 
 		self._resetADC()
 		adcPollingThreadHandle = threading.Thread(target=self._adcPollingThread, daemon=True)
@@ -64,10 +82,8 @@ class ModNO2:
 
 	def _resetADC(self):
 		""" Issues reset command to ADC. """
-		try:
+		with busLock:
 			self.bus.write_byte(ADC_ADDR, 0x06)
-		except Exception as e:
-			raise e
 
 	def _isDataReady(self):
 		""" Queries ADC to see if data is available to be read.
@@ -76,182 +92,134 @@ class ModNO2:
 		:rtype: bool
 
 		"""
-		try:
-			write = i2c_msg.write(ADC_ADDR, [0x24])
-			read = i2c_msg.read(ADC_ADDR, 1)
-			self.bus.i2c_rdwr(write, read)
+		with busLock:
+			return (self.bus.read_byte_data(ADC_ADDR, 0x24) & 0x80) != 0
+
+	def _readChannel(self, config):
+		""" Read and convert a single ADC input channel to a voltage.
 
-			ready = list(read)[0] >> 7
+		:param config: ADC config register value selecting the input channel
+		:type config: int
+		:return: The channel voltage, or -1 if no data was available.
+		:rtype: float
 
-			if ready == 1:
-				return True
-			else:
-				return False
-		except Exception as e:
-			raise e
+		"""
+		# Write the channel config and trigger the conversion in a single
+		# kernel transaction rather than two separate SMBus calls
+		configure = i2c_msg.write(ADC_ADDR, [0x40, config])
+		trigger = i2c_msg.write(ADC_ADDR, [0x08])
+		with busLock:
+			self.bus.i2c_rdwr(configure, trigger)
+
+		# Poll the data-ready flag instead of sleeping for the full nominal
+		# conversion time - the ADC is usually ready well inside the 20 SPS window
+		deadline = time.monotonic() + 0.1
+		while not self._isDataReady():
+			if time.monotonic() > deadline:
+				return -1
+			time.sleep(0.002)
+
+		# SMBus word reads are little-endian, swap to the ADC's byte order
+		with busLock:
+			word = self.bus.read_word_data(ADC_ADDR, 0x10)
+		return (((word & 0xFF) << 8) | (word >> 8)) * ADC_LSB
 
 	def _readVrefChannel(self):
-		""" Read and convert AIN1 (sensor Vref) to a voltage. 
+		""" Read and convert AIN1 (sensor Vref) to a voltage.
 
 		:return: The voltage of AIN1 (sensor Vref).
 		:rtype: float
 
 		"""
-		try:
-			# 0x81 is the config register data
-			# AINp = AIN1, AINn = GND
-			# Gain = 1
-			# 20 SPS
-			# Single conversion
-			# External reference
-			self.bus.write_byte_data(ADC_ADDR, 0x40, 0x81)
-
-			# Trigger read
-			self.bus.write_byte(ADC_ADDR, 0x08)
-
-			time.sleep(0.05)
-
-			if self._isDataReady():
-				write = i2c_msg.write(ADC_ADDR, [0x10])
-				read = i2c_msg.read(ADC_ADDR, 2)
-				self.bus.i2c_rdwr(write, read)
-
-				read = list(read)
-				voltage = ((read[0] << 8) + read[1]) * (ADC_REF / ADC_UPPER)
-				return round(voltage, 3)
-			else:
-				return -1
-		except Exception as e:
-			raise e
+		return self._readChannel(ADC_CFG_VREF)
 
 	def _readVgasChannel(self):
-		""" Read and convert AIN0 (sensor Vgas) to a voltage. 
+		""" Read and convert AIN0 (sensor Vgas) to a voltage.
 
 		:return: The voltage of AIN0 (sensor Vgas).
 		:rtype: float
 
 		"""
-		try:
-			# 0x61 is the config register data
-			# AINp = AIN0, AINn = GND
-			# Gain = 1
-			# 20 SPS
-			# Single conversion
-			# External reference
-			self.bus.write_byte_data(ADC_ADDR, 0x40, 0x61)
-
-			# Trigger read
-			self.bus.write_byte(ADC_ADDR, 0x08)
-
-			time.sleep(0.05)
-
-			if self._isDataReady():
-				write = i2c_msg.write(ADC_ADDR, [0x10])
-				read = i2c_msg.read(ADC_ADDR, 2)
-				self.bus.i2c_rdwr(write, read)
-
-				read = list(read)
-				voltage = ((read[0] << 8) + read[1]) * (ADC_REF / ADC_UPPER)
-				return round(voltage, 3)
-			else:
-				return -1
-		except Exception as e:
-			raise e
+		return self._readChannel(ADC_CFG_VGAS)
 
 	def _readVtempChannel(self):
 		""" Read and convert AIN2 (sensor Vtemp) to a voltage.
 
 		:return: The voltage of AIN2 (sensor Vtemp).
 		:rtype: float
-		
+
 		"""
-		try:
-			# 0xA1 is the config register data
-			# AINp = AIN2, AINn = GND
-			# Gain = 1
-			# 20 SPS
-			# Single conversion
-			# External reference
-			self.bus.write_byte_data(ADC_ADDR, 0x40, 0xA1)
-
-			# Trigger read
-			self.bus.write_byte(ADC_ADDR, 0x08)
-
-			time.sleep(0.05)
-
-			if self._isDataReady():
-				write = i2c_msg.write(ADC_ADDR, [0x10])
-				read = i2c_msg.read(ADC_ADDR, 2)
-				self.bus.i2c_rdwr(write, read)
-
-				read = list(read)
-				voltage = ((read[0] << 8) + read[1]) * (ADC_REF / ADC_UPPER)
-				return round(voltage, 3)
-			else:
-				return -1
-		except Exception as e:
-			raise e
-
-	def _calculateMovingAverage(self, new_data_point, data_list, average_size):
-		""" Function to calculate a simple moving average """
-		# Add fresh data
-		data_list.insert(0, new_data_point)
-		try:
-			# Remove nth item in list
-			data_list.pop(average_size)
-		except Exception as e:
-			pass
-		total = 0
-		total = sum(data_list)
-        
-		#value = math.ceil(total / len(data_list))
-		value = round(total / len(data_list), 2)
-		if(value == None):
-			return 0
-		else:
-			return value
+		return self._readChannel(ADC_CFG_VTEMP)
+
+	def _calculateMovingAverage(self, new_data_point):
+		""" Function to calculate a simple moving average incrementally """
+		# Retire the oldest sample from the running sum once the window is full,
+		# then let the deque evict it - O(1) per update instead of re-summing
+		if len(self.no2AverageDeque) == self.no2AverageDeque.maxlen:
+			self.no2AverageSum -= self.no2AverageDeque[0]
+		self.no2AverageDeque.append(new_data_point)
+		self.no2AverageSum += new_data_point
+		return round(self.no2AverageSum / len(self.no2AverageDeque), 2)
 
 	def _adcPollingThread(self):
 		""" Thread that polls the ADC to provide an updated NO2 value every five seconds """
+		# Hoist unchanging lookups into locals, the loop below runs for the
+		# lifetime of the process
+		readVgas = self._readVgasChannel
+		readVref = self._readVrefChannel
+		voffset = self.voffset
+		invScale = self._invScale
+		sleep = time.sleep
+
 		vref = -1
 		vgasList = []
-		vgasLastMode = 0
+		cyclesSinceVref = 0
 
 		while vref == -1:
-			vref = self._readVrefChannel()
+			vref = readVref()
 
 		while True:
 			try:
+				# The reference voltage drifts with temperature, refresh it
+				# every so often rather than trusting the startup value forever
+				cyclesSinceVref += 1
+				if cyclesSinceVref >= VREF_REFRESH_CYCLES:
+					newVref = readVref()
+					if newVref != -1:
+						vref = newVref
+					cyclesSinceVref = 0
+
 				# Take 10 voltage readings from ADC
-				for i in range(1, 10):
+				for sample in range(10):
 					vgas = -1
-					# Wait until ADC says data is available
-					while vgas == -1:
-						vgas = self._readVgasChannel()
-						time.sleep(0.1)
-
-					# Append each sample to list and wait before taking another reading
-					vgasList.append(vgas)
-					time.sleep(0.25)
-				# Take mode value for use in calculations to help reduce sensor noise (ADC and inputs seem noisy)
-				try:
-					vgasLastMode = vgas
-					vgas = mode(vgasList)
-				except Exception as e:
-					vgasList.clear()
-
-				if vgas != -1 and vref != -1:
-					vgas0 = vref + self.voffset
-					conc = (vgas - vgas0) / (self.tia_gain * 1e3) / (self.sensitivity * 1e-9)
-					conc = round(conc, 2)
+					# Bounded retry so a stuck ADC cannot wedge this thread
+					for attempt in range(5):
+						vgas = readVgas()
+						if vgas != -1:
+							break
+						sleep(0.1)
+
+					if vgas != -1:
+						vgasList.append(vgas)
+					# Wait before taking another reading, skipping the gap after the final sample
+					if sample < 9:
+						sleep(0.25)
+
+				if vgasList and vref != -1:
+					# Take median value for use in calculations to help reduce sensor noise
+					# (ADC and inputs seem noisy) - unlike mode, median never fails on ties
+					vgas = median(vgasList)
+
+					vgas0 = vref + voffset
+					conc = (vgas - vgas0) * invScale
+
+					# Calculate moving average to use for value
+					self.no2Value = self._calculateMovingAverage(conc)
 			except Exception as e:
 				pass
 
-			# Calculate moving average to use for value
-			self.no2Value = self._calculateMovingAverage(conc, self.no2AverageList, self.movingAverageWindow)
-
 			vgasList.clear()
-			time.sleep(2.5)
+			sleep(2.5)
 
 	def readNO2(self):
 		""" Returns an NO2 reading. 
@@ -282,14 +250,11 @@ class ModNO2:
         :rtype: dict, int
 
         """
-		try:
-			sensorData = {}
-			no2 = self.readNO2()
-			sensorData['sensor'] = moduleVersionString
-			if no2 != -1:
-				sensorData['no2'] = no2
-				return {'no2': sensorData}
-			else:
-				return -1
-		except Exception as e:
-			raise e
\ No newline at end of file
+		sensorData = {}
+		no2 = self.readNO2()
+		sensorData['sensor'] = moduleVersionString
+		if no2 != -1:
+			sensorData['no2'] = no2
+			return {'no2': sensorData}
+		else:
+			return -1
\ No newline at end of file
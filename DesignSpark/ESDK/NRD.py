@@ -6,62 +6,52 @@ ESDK NRD board interface
 '''
 
 import time
-import smbus2
+import struct
 from smbus2 import i2c_msg
+from ._i2c import busLock, getSharedBus
 
 moduleVersionString = "NRD0.1"
 
 MOD_ADDR = 0x60
 
 class ModNRD:
-	""" This is a class that handles interfacing with the ESDK-NRD board. """
-	def __init__(self):
-		try:
-			self.bus = smbus2.SMBus(1)
-		except Exception as e:
-			raise e
+	""" This is a class that handles interfacing with the ESDK-NRD board.
+
+	:param bus: An optional shared SMBus object, the shared bus handle is used if not supplied
+	:type bus: smbus2.SMBus, optional
+	"""
+	def __init__(self, bus=None):
+		self.bus = bus if bus is not None else getSharedBus()
 
 	def enableI2CWatchdog(self):
 		""" Enable NRD I2C watchdog functionality. """
-		try:
+		with busLock:
 			self.bus.write_i2c_block_data(MOD_ADDR, 0x07, [0x01])
-		except Exception as e:
-			raise e
 
 	def disableI2CWatchdog(self):
 		""" Disable NRD I2C watchdog functionality. """
-		try:
+		with busLock:
 			self.bus.write_i2c_block_data(MOD_ADDR, 0x07, [0x00])
-		except Exception as e:
-			raise e
 
 	def enableEventLed(self):
 		""" Enable the event detection LED. """
-		try:
+		with busLock:
 			self.bus.write_i2c_block_data(MOD_ADDR, 0x04, [0x01])
-		except Exception as e:
-			raise e
 
 	def disableEventLed(self):
 		""" Disable the event detection LED. """
-		try:
+		with busLock:
 			self.bus.write_i2c_block_data(MOD_ADDR, 0x04, [0x00])
-		except Exception as e:
-			raise e
 
 	def enableEventGpio(self):
 		""" Enable the event detection GPIO output. """
-		try:
+		with busLock:
 			self.bus.write_i2c_block_data(MOD_ADDR, 0x06, [0x01])
-		except Exception as e:
-			raise e
 
 	def disableEventGpio(self):
 		""" Disable the event detection GPIO output. """
-		try:
+		with busLock:
 			self.bus.write_i2c_block_data(MOD_ADDR, 0x06, [0x00])
-		except Exception as e:
-			raise e
 
 	def getEventLedEnabledState(self):
 		""" Get the event LED enabled state.
@@ -70,14 +60,12 @@ class ModNRD:
 		:rtype: bool
 
 		"""
-		try:
+		with busLock:
 			status = self.bus.read_byte_data(MOD_ADDR, 0x04)
-			if status == 0x01:
-				return True
-			if status == 0x00:
-				return False
-		except Exception as e:
-			raise e
+		if status == 0x01:
+			return True
+		if status == 0x00:
+			return False
 
 	def getEventGpioEnabledState(self):
 		""" Get the event GPIO enabled state.
@@ -86,14 +74,12 @@ class ModNRD:
 		:rtype: bool
 
 		"""
-		try:
+		with busLock:
 			status = self.bus.read_byte_data(MOD_ADDR, 0x06)
-			if status == 0x01:
-				return True
-			if status == 0x00:
-				return False
-		except Exception as e:
-			raise e
+		if status == 0x01:
+			return True
+		if status == 0x00:
+			return False
 
 	def getI2CWatchdogEnabledState(self):
 		""" Get the NRD I2C watchdog enabled state.
@@ -102,14 +88,12 @@ class ModNRD:
 		:rtype: bool
 
 		"""
-		try:
+		with busLock:
 			status = self.bus.read_byte_data(MOD_ADDR, 0x07)
-			if status == 0x01:
-				return True
-			if status == 0x00:
-				return False
-		except Exception as e:
-			raise e
+		if status == 0x01:
+			return True
+		if status == 0x00:
+			return False
 
 	def readCountsPerSecond(self):
 		""" Get the current CPS rate.
@@ -119,11 +103,9 @@ class ModNRD:
 
 		"""
 
-		try:
+		with busLock:
 			cps = self.bus.read_byte_data(MOD_ADDR, 0x01)
-			return cps
-		except Exception as e:
-			raise e
+		return cps
 
 	def readCountsPerMinute(self):
 		""" Get the current CPM rate.
@@ -133,16 +115,10 @@ class ModNRD:
 
 		"""
 
-		try:
-			write = i2c_msg.write(MOD_ADDR, [0x02])
-			read = i2c_msg.read(MOD_ADDR, 2)
-			self.bus.i2c_rdwr(write, read)
-			data = list(read)
-
-			cpm = int.from_bytes(data, "big")
-			return cpm
-		except Exception as e:
-			raise e
+		with busLock:
+			cpm = self.bus.read_word_data(MOD_ADDR, 0x02)
+		# SMBus word reads are little-endian, swap to the module's byte order
+		return ((cpm & 0xFF) << 8) | (cpm >> 8)
 
 	def readTotalCounts(self):
 		""" Get the total accumulated event count
@@ -152,23 +128,18 @@ class ModNRD:
 
 		"""
 
-		try:
-			write = i2c_msg.write(MOD_ADDR, [0x03])
-			read = i2c_msg.read(MOD_ADDR, 4)
+		write = i2c_msg.write(MOD_ADDR, [0x03])
+		read = i2c_msg.read(MOD_ADDR, 4)
+		with busLock:
 			self.bus.i2c_rdwr(write, read)
-			data = list(read)
 
-			count = int.from_bytes(data, "big")
-			return count
-		except Exception as e:
-			raise e
+		count, = struct.unpack('>I', bytes(read))
+		return count
 
 	def resetCounts(self):
 		""" Reset all event counters. """
-		try:
+		with busLock:
 			self.bus.write_byte_data(MOD_ADDR, 0x05, 0x01)
-		except Exception as e:
-			raise e
 
 	def readSensors(self):
 		""" Reads sensors and returns a dictionary containing module version and readings.
@@ -190,17 +161,14 @@ class ModNRD:
 
 		"""
 
-		try:
-			sensorData = {}
-			cpsReading = self.readCountsPerSecond()
-			cpmReading = self.readCountsPerMinute()
-			totalReading = self.readTotalCounts()
+		sensorData = {}
+		cpsReading = self.readCountsPerSecond()
+		cpmReading = self.readCountsPerMinute()
+		totalReading = self.readTotalCounts()
 
-			sensorData['sensor'] = moduleVersionString
-			sensorData['cps'] = cpsReading
-			sensorData['cpm'] = cpmReading
-			sensorData['totalCounts'] = totalReading
+		sensorData['sensor'] = moduleVersionString
+		sensorData['cps'] = cpsReading
+		sensorData['cpm'] = cpmReading
+		sensorData['totalCounts'] = totalReading
 
-			return {'nrd': sensorData}
-		except Exception as e:
-			raise e
\ No newline at end of file
+		return {'nrd': sensorData}
\ No newline at end of file
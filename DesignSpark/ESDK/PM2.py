@@ -6,38 +6,35 @@ ESDK PM2 board interface
 '''
 
 import time
-import smbus2
+import struct
+import threading
 from smbus2 import i2c_msg
+from ._crc import crc8
+from ._i2c import busLock, getSharedBus
 
 moduleVersionString = "PM20.2"
 
 SPS_ADDR = 0x69
 
 class ModPM2:
-    """ This is a class that handles interfacing with the ESDK-PM2 board. """
-    def __init__(self):
-        try:
-            self.bus = smbus2.SMBus(1)
-        except Exception as e:
-            raise e
+    """ This is a class that handles interfacing with the ESDK-PM2 board.
+
+    :param bus: An optional shared SMBus object, the shared bus handle is used if not supplied
+    :type bus: smbus2.SMBus, optional
+    """
+    def __init__(self, bus=None):
+        self.bus = bus if bus is not None else getSharedBus()
 
         self.__reset()
         self.__wakeSensor()
         self.startMeasurement()
 
-    def __calculateCrc(self, input):
-        """ Calculates CRC for communicating with SPS30 """
-        ''' Taken from https://github.com/DFRobot/DFRobot_SGP40/blob/master/Python/raspberrypi/DFRobot_SGP40.py '''
-        crc = 0xff
-        for i in range(0,2):
-            crc = crc^input[i]
-            for bit in range(0,8):
-                if(crc&0x80):
-                    crc = ((crc <<1)^0x31)
-                else:
-                    crc = (crc<<1)
-            crc = crc&0xFF
-        return crc
+        # Latest reading published by the polling thread
+        self.__lastPM = None
+        self.__lastPMLock = threading.Lock()
+        pmPollingThreadHandle = threading.Thread(target=self.__pmPollingThread, daemon=True)
+        pmPollingThreadHandle.name = "pm2_pmPollingThreadHandle"
+        pmPollingThreadHandle.start()
 
     def __isDataReady(self):
         """ Queries SPS30 to see if there is available data to read
@@ -46,45 +43,36 @@ class ModPM2:
         :rtype: bool
 
         """
-        try:
-            write = i2c_msg.write(SPS_ADDR, [0x02, 0x02])
-            read = i2c_msg.read(SPS_ADDR, 3)
-            self.bus.i2c_rdwr(write)
-            time.sleep(0.001)
-            self.bus.i2c_rdwr(read)
-            if list(read)[1] == 0x01:
-                return True
-            else:
-                return False
-        except Exception as e:
-            raise e
+        write = i2c_msg.write(SPS_ADDR, [0x02, 0x02])
+        read = i2c_msg.read(SPS_ADDR, 3)
+        # Combined transfer issues a repeated-START between the pointer write
+        # and the read, avoiding a second ioctl and the inter-command delay
+        with busLock:
+            self.bus.i2c_rdwr(write, read)
+        return bytes(read)[1] == 0x01
 
     def __reset(self):
         """ Attempts to reset sensor and delay for the reset time period. """
-        try:
+        with busLock:
             self.bus.write_i2c_block_data(SPS_ADDR, 0xD3, [0x04])
-            time.sleep(0.1)
-        except Exception as e:
-            raise e
+        time.sleep(0.1)
 
     def __wakeSensor(self):
         """ Sends command to wake sensor twice (as per sensor datasheet). """
-        try:
-            self.bus.write_i2c_block_data(SPS_ADDR, 0x11, [0x03])
-            self.bus.write_i2c_block_data(SPS_ADDR, 0x11, [0x03])
-        except Exception as e:
-            raise e
+        # Both wake commands go out in one combined transfer, separated by a
+        # repeated-START rather than two full START/STOP sequences
+        wakeFirst = i2c_msg.write(SPS_ADDR, [0x11, 0x03])
+        wakeSecond = i2c_msg.write(SPS_ADDR, [0x11, 0x03])
+        with busLock:
+            self.bus.i2c_rdwr(wakeFirst, wakeSecond)
 
     def startMeasurement(self):
         """ Starts measurement, configures readings to be unsigned 16-bit integers. """
-        try:
-            command = [0x00, 0x10, 0x05, 0x00]
-            crc = self.__calculateCrc(command[2:4])
-            command.append(crc)
-            write = i2c_msg.write(SPS_ADDR, command)
+        command = [0x00, 0x10, 0x05, 0x00]
+        command.append(crc8(command[2:4]))
+        write = i2c_msg.write(SPS_ADDR, command)
+        with busLock:
             self.bus.i2c_rdwr(write)
-        except Exception as e:
-            raise e
 
     def __readSensor(self):
         """ Attempts to read sensor data and pack into a dictionary.
@@ -100,33 +88,47 @@ class ModPM2:
                 "pm10":0
             }
 
-        :rtype: dict
+        Or -1 if a reading fails its CRC check
+
+        :rtype: dict, int
 
         """
-        try:
-            write = i2c_msg.write(SPS_ADDR, [0x03, 0x00])
-            read = i2c_msg.read(SPS_ADDR, 30)
-            self.bus.i2c_rdwr(write)
-            time.sleep(0.001)
-            self.bus.i2c_rdwr(read)
-            raw_data = list(read)
-
-            # Convert to integer values
-            pm10 = (raw_data[0] << 8) + raw_data[1]
-            pm25 = (raw_data[3] << 8) + raw_data[4]
-            pm40 = (raw_data[6] << 8) + raw_data[7]
-            pm100 = (raw_data[9] << 8) + raw_data[10]
-
-            data = {
-                "pm1.0": pm10,
-                "pm2.5": pm25,
-                "pm4.0": pm40,
-                "pm10": pm100
-            }
+        write = i2c_msg.write(SPS_ADDR, [0x03, 0x00])
+        read = i2c_msg.read(SPS_ADDR, 30)
+        with busLock:
+            self.bus.i2c_rdwr(write, read)
+        buf = bytes(read)
+
+        # Verify the CRC byte trailing each mass concentration word
+        for offset in range(0, 12, 3):
+            if crc8(buf[offset:offset + 2]) != buf[offset + 2]:
+                return -1
 
-            return data
-        except Exception as e:
-            raise e
+        # Each reading is a big-endian word followed by a CRC byte the
+        # pad bytes skip over
+        pm10, pm25, pm40, pm100 = struct.unpack_from('>HxHxHxHx', buf)
+
+        data = {
+            "pm1.0": pm10,
+            "pm2.5": pm25,
+            "pm4.0": pm40,
+            "pm10": pm100
+        }
+
+        return data
+
+    def __pmPollingThread(self):
+        """ Thread that polls the sensor at its 1Hz output rate and caches the reading """
+        while True:
+            try:
+                if self.__isDataReady():
+                    readings = self.__readSensor()
+                    if readings != -1:
+                        with self.__lastPMLock:
+                            self.__lastPM = readings
+            except Exception as e:
+                pass
+            time.sleep(1.0)
 
     def readSensors(self):
         """ Reads sensors and returns a dictionary containing module version, and all readings.
@@ -150,19 +152,15 @@ class ModPM2:
         :rtype: dict, int
 
         """
-        try:
-            if self.__isDataReady():
-                sensorData = {"sensor": moduleVersionString}
-                sensorData.update(self.__readSensor())
-                return {'pm': sensorData}
-            else:
-                return -1
-        except Exception as e:
-            raise e
+        with self.__lastPMLock:
+            readings = self.__lastPM
+        if readings is None:
+            return -1
+        sensorData = {"sensor": moduleVersionString}
+        sensorData.update(readings)
+        return {'pm': sensorData}
 
     def startFanCleaning(self):
         """ Starts fan cleaning procedure. """
-        try:
-            self.bus.write_i2c_block_data(SPS_ADDR, 0x56, [0x07])
-        except Exception as e:
-            raise e
\ No newline at end of file
+        with busLock:
+            self.bus.write_i2c_block_data(SPS_ADDR, 0x56, [0x07])
\ No newline at end of file
@@ -5,8 +5,9 @@
 ESDK THV board interface
 '''
 
-import smbus2
 from smbus2 import i2c_msg
+from ._crc import crc8
+from ._i2c import busLock, getSharedBus
 import time
 from .DFRobot_SGP40_VOCAlgorithm import DFRobot_VOCAlgorithm
 
@@ -15,6 +16,9 @@ moduleVersionString = "THV0.2"
 SHT_ADDR = 0x44
 SGP_ADDR = 0x59
 
+# How long a SHT31 measurement is reused before triggering a fresh one
+SHT_CACHE_TIME = 1.0
+
 # SGP40 commands
 SGP40_MEASURE_RAW_SIGNAL = [0x26, 0x0F]
 SGP40_EXECUTE_SELF_TEST = [0x28, 0x0E]
@@ -24,38 +28,31 @@ SGP40_MEASURE_RAW_NO_COMP = [0x26, 0x0F, 0x80, 0x00, 0xA2, 0x66, 0x66, 0x93]
 
 
 class ModTHV:
-    """ This is a class that handles interfacing with the ESDK-THV board. """
-    def __init__(self):
+    """ This is a class that handles interfacing with the ESDK-THV board.
+
+    :param bus: An optional shared SMBus object, the shared bus handle is used if not supplied
+    :type bus: smbus2.SMBus, optional
+    """
+    def __init__(self, bus=None):
         self.algorithm = DFRobot_VOCAlgorithm()
         self.algorithm.vocalgorithm_init()
 
-        try:
-            self.bus = smbus2.SMBus(1)
-        except Exception as e:
-            raise e
+        self.bus = bus if bus is not None else getSharedBus()
+
+        self.__lastTH = None
+        self.__lastTHTime = 0
         
         startTime = int(time.time())
         while (int(time.time()) - startTime < 10):
             self.readVocIndex()
 
-    def __sgp40_crc(self, data1, data2):
-        """ Calculates a CRC for two bytes of data, according to SGP40 datasheet. """
-        ''' Taken from https://github.com/DFRobot/DFRobot_SGP40/blob/master/Python/raspberrypi/DFRobot_SGP40.py '''
-        crc = 0xff
-        list = [data1, data2]
-        for i in range(0,2):
-            crc = crc^list[i]
-            for bit in range(0,8):
-                if(crc&0x80):
-                    crc = ((crc <<1)^0x31)
-                else:
-                    crc = (crc<<1)
-            crc = crc&0xFF
-        return crc
-
     def __readTempAndHumidityRaw(self):
         """ Queries SHT31 and returns a dictionary of raw temperature and humidity values.
 
+        Measurements are cached briefly, so a VOC read shortly after a
+        temperature read reuses the value instead of paying the 0.5s
+        high repeatability measurement time again.
+
         :return: A dictionary containing
 
         .. code-block:: text
@@ -65,27 +62,38 @@ class ModTHV:
                 "humidity":5678
             }
 
-        :rtype: dict
+        Or -1 if a reading fails its CRC check
+
+        :rtype: dict, int
 
         """
-        try:
-            ''' Send high repeatability measurement command without clock stretching '''
+        if self.__lastTH is not None and time.monotonic() - self.__lastTHTime < SHT_CACHE_TIME:
+            return self.__lastTH
+
+        ''' Send high repeatability measurement command without clock stretching '''
+        # Hold the bus for the whole command/wait/read sequence
+        with busLock:
             self.bus.write_i2c_block_data(SHT_ADDR, 0x24, [0x00])
 
             time.sleep(0.5)
 
             raw_data = self.bus.read_i2c_block_data(SHT_ADDR, 0x00, 6)
-            raw_temp = raw_data[0] * 256 + raw_data[1]
-            raw_humidity = raw_data[3] * 256 + raw_data[4]
 
-            values = {
-                "temp": raw_temp,
-                "humidity": raw_humidity
-            }
+        # Verify the CRC byte trailing each word before using the values
+        if crc8(raw_data[0:2]) != raw_data[2] or crc8(raw_data[3:5]) != raw_data[5]:
+            return -1
+
+        raw_temp = raw_data[0] * 256 + raw_data[1]
+        raw_humidity = raw_data[3] * 256 + raw_data[4]
+
+        values = {
+            "temp": raw_temp,
+            "humidity": raw_humidity
+        }
 
-            return values
-        except Exception as e:
-            raise e
+        self.__lastTH = values
+        self.__lastTHTime = time.monotonic()
+        return values
 
     def readTempAndHumidity(self):
         """ Queries SHT31 and returns a dictionary of temperature and humidity values.
@@ -99,24 +107,25 @@ class ModTHV:
                 "humidity":50.3
             }
 
-        :rtype: dict
+        Or -1 if sensor data is unavailable
+
+        :rtype: dict, int
 
         """
-        try:
-            v = self.__readTempAndHumidityRaw()
+        v = self.__readTempAndHumidityRaw()
+        if v == -1:
+            return -1
 
-            ''' Calculations taken from SHT31 datasheet, section 4.13 '''
-            temperature = round(-45 + (175 * v['temp'] / 65535.0), 1)
-            humidity = round(100 * v['humidity'] / 65535.0, 1)
+        ''' Calculations taken from SHT31 datasheet, section 4.13 '''
+        temperature = round(-45 + (175 * v['temp'] / 65535.0), 1)
+        humidity = round(100 * v['humidity'] / 65535.0, 1)
 
-            values = {
-                "temperature": temperature,
-                "humidity": humidity
-            }
+        values = {
+            "temperature": temperature,
+            "humidity": humidity
+        }
 
-            return values
-        except Exception as e:
-            raise e
+        return values
 
     def readVocRaw(self):
         """ Returns a compensated raw VOC value. 
@@ -124,33 +133,34 @@ class ModTHV:
         :return: An integer VOC value
         :rtype: int
         """
-        try:
-            th = self.__readTempAndHumidityRaw()
-            ''' Split values into upper and lower bytes to prepare for sending to sensor '''
-            tempUpperByte = int(th['temp']) >> 8
-            tempLowerByte = int(th['temp']) & 0xFF
+        th = self.__readTempAndHumidityRaw()
+        if th == -1:
+            return -1
+
+        ''' Split values into upper and lower bytes to prepare for sending to sensor '''
+        tempUpperByte = int(th['temp']) >> 8
+        tempLowerByte = int(th['temp']) & 0xFF
 
-            humidityUpperByte = int(th['humidity']) >> 8
-            humidityLowerByte = int(th['humidity']) & 0xFF
+        humidityUpperByte = int(th['humidity']) >> 8
+        humidityLowerByte = int(th['humidity']) & 0xFF
 
-            tempCrc = self.__sgp40_crc(tempUpperByte, tempLowerByte)
-            humidityCrc = self.__sgp40_crc(humidityUpperByte, humidityLowerByte)
+        tempCrc = crc8((tempUpperByte, tempLowerByte))
+        humidityCrc = crc8((humidityUpperByte, humidityLowerByte))
 
-            ''' Perform write and then read after 30ms delay, as per datasheet '''
-            write = i2c_msg.write(SGP_ADDR, [0x26, 0x0F, humidityUpperByte, humidityLowerByte, humidityCrc, tempUpperByte, tempLowerByte, tempCrc])
-            read = i2c_msg.read(SGP_ADDR, 3)
+        ''' Perform write and then read after 30ms delay, as per datasheet '''
+        write = i2c_msg.write(SGP_ADDR, [0x26, 0x0F, humidityUpperByte, humidityLowerByte, humidityCrc, tempUpperByte, tempLowerByte, tempCrc])
+        read = i2c_msg.read(SGP_ADDR, 3)
+        with busLock:
             self.bus.i2c_rdwr(write)
             time.sleep(0.03)
             self.bus.i2c_rdwr(read)
-            read = list(read)
+        read = list(read)
 
-            if self.__sgp40_crc(read[0], read[1]) == read[2]:
-                vocRaw = (read[0] << 8) + read[1]
-                return vocRaw
-            else:
-                return -1
-        except Exception as e:
-            raise e
+        if crc8(read[0:2]) == read[2]:
+            vocRaw = (read[0] << 8) + read[1]
+            return vocRaw
+        else:
+            return -1
 
     def readVocIndex(self):
         """ Returns a calculated VOC index value.
@@ -187,16 +197,16 @@ class ModTHV:
         :rtype: dict, int
 
         """
-        try:
-            sensorData = {}
-            vocIndex = self.readVocIndex()
-            tempAndHumidity = self.readTempAndHumidity()
-            if vocIndex != -1 and tempAndHumidity != -1:
-                sensorData['vocIndex'] = vocIndex
-                sensorData.update(tempAndHumidity)
-                sensorData['sensor'] = moduleVersionString
-                return {"thv": sensorData}
-            else:
-                return -1
-        except Exception as e:
-            raise e
\ No newline at end of file
+        vocIndex = self.readVocIndex()
+        # Bail out before the temperature read if the VOC read already failed
+        if vocIndex == -1:
+            return -1
+        tempAndHumidity = self.readTempAndHumidity()
+        if tempAndHumidity == -1:
+            return -1
+
+        sensorData = {}
+        sensorData['vocIndex'] = vocIndex
+        sensorData.update(tempAndHumidity)
+        sensorData['sensor'] = moduleVersionString
+        return {"thv": sensorData}
\ No newline at end of file
@@ -6,4 +6,19 @@
 A Python library for use with DesignSpark ESDK boards.
 """
 
-__version__ = '23.2.1'
\ No newline at end of file
+import importlib
+
+__version__ = '23.2.1'
+
+# Driver submodules exposed lazily via PEP 562, so importing the package does
+# not drag in smbus2, RPi.GPIO and the other hardware-facing dependencies
+# until a module is actually used
+_submodules = {'AppLogger', 'CO2', 'FDH', 'MAIN', 'NO2', 'NRD', 'PM2', 'THV'}
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | _submodules)
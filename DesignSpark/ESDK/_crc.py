@@ -0,0 +1,35 @@
+# Copyright (c) 2022 RS Components Ltd
+# SPDX-License-Identifier: MIT License
+
+'''
+CRC-8 helper shared by Sensirion-based ESDK modules
+'''
+
+def _buildTable():
+    """ Builds the 256-entry lookup table for CRC-8 polynomial 0x31. """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+_CRC8_TABLE = _buildTable()
+
+def crc8(data):
+    """ Calculates a Sensirion CRC-8 (polynomial 0x31, init 0xFF) of a byte sequence.
+
+    :param data: The bytes to checksum
+    :type data: bytes, bytearray or iterable of int
+    :return: The CRC-8 of the data
+    :rtype: int
+
+    """
+    crc = 0xFF
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
@@ -0,0 +1,34 @@
+# Copyright (c) 2022 RS Components Ltd
+# SPDX-License-Identifier: MIT License
+
+'''
+Shared I2C bus handle for ESDK modules
+'''
+
+import threading
+
+import smbus2
+
+_sharedBus = None
+
+# Guards every transaction sequence on the shared bus. smbus2's register-style
+# helpers cache the slave address on the handle before the data transfer, so
+# interleaved calls from two threads can direct a transfer at the wrong
+# device - hold this lock around every bus access sequence.
+busLock = threading.Lock()
+
+def getSharedBus():
+    """ Returns a process-wide bus handle for /dev/i2c-1, opened on first use.
+
+    Sensor modules fall back to this handle when no bus is supplied, so a
+    fully populated ESDK holds a single file descriptor on the bus device
+    rather than one per module.
+
+    :return: The shared bus handle
+    :rtype: smbus2.SMBus
+
+    """
+    global _sharedBus
+    if _sharedBus is None:
+        _sharedBus = smbus2.SMBus(1)
+    return _sharedBus
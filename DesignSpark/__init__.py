@@ -1,6 +0,0 @@
-# -*- coding: utf-8 -*-
-# Copyright (c) 2021 RS Components Ltd
-# SPDX-License-Identifier: MIT License
-
-from pkgutil import extend_path
-__path__ = extend_path(__path__, __name__)
\ No newline at end of file